@@ -1,3 +1,103 @@
+import array
+import functools
+import itertools
+import operator
+import struct
+import sys
+
+_BLOCK_BITS = 4096 # bits encoded per int.to_bytes; larger blocks make each shift slower
+
+_BYTE_TABLES = {} # (bitwidth, endian) -> the values packed in each of the 256 possible bytes
+
+def _byte_table(bitwidth, endian):
+    table = _BYTE_TABLES.get((bitwidth, endian))
+    if table is None:
+        value_mask = (1 << bitwidth) - 1
+        if endian == 'little':
+            shifts = range(0, 8, bitwidth)
+        else:
+            shifts = range(8 - bitwidth, -1, -bitwidth)
+        table = [tuple((byte >> shift) & value_mask for shift in shifts) for byte in range(256)]
+        _BYTE_TABLES[bitwidth, endian] = table
+    return table
+
+def _decode_range(storage, bitwidth, bitoffset, endian, start_idx, count, out):
+    '''
+    Append count values decoded from index start_idx of packed storage to the list out.
+
+    When bitwidth divides 8 and no value straddles a byte, whole bytes are expanded through a 256-entry table,
+    so the loop over bytes and values runs entirely in C.
+    '''
+    if bitwidth in (1, 2, 4) and bitoffset % bitwidth == 0:
+        values_per_byte = 8 // bitwidth
+        head = min(count, -(start_idx + bitoffset // bitwidth) % values_per_byte)
+        nbytes = (count - head) // values_per_byte
+        _decode_groups(storage, bitwidth, bitoffset, endian, start_idx, head, out)
+        first = ((start_idx + head) * bitwidth + bitoffset) >> 3
+        out.extend(itertools.chain.from_iterable(map(_byte_table(bitwidth, endian).__getitem__, storage[first:first + nbytes])))
+        done = head + nbytes * values_per_byte
+        _decode_groups(storage, bitwidth, bitoffset, endian, start_idx + done, count - done, out)
+    else:
+        _decode_groups(storage, bitwidth, bitoffset, endian, start_idx, count, out)
+
+def _decode_groups(storage, bitwidth, bitoffset, endian, start_idx, count, out):
+    '''
+    Append count values decoded from index start_idx of packed storage to the list out.
+
+    Any 8 consecutive values span exactly bitwidth bytes at the same sub-byte offset, so values are unpacked
+    8 at a time from small integers with one set of shifts chosen for the bitwidth, offset and endian.
+    '''
+    value_mask = (1 << bitwidth) - 1
+    bits = start_idx * bitwidth + bitoffset
+    first = bits >> 3
+    bitshift = bits & 7
+    groups, remainder = divmod(count, 8)
+    group_bytes = bitwidth + (bitshift != 0)
+    from_bytes = int.from_bytes
+    if endian == 'little':
+        shifts = range(bitshift, bitshift + 8 * bitwidth, bitwidth)
+    else:
+        top = group_bytes * 8 - bitshift
+        shifts = range(top - bitwidth, top - 9 * bitwidth, -bitwidth)
+    group_end = first + groups * bitwidth
+    out.extend([(data >> shift) & value_mask
+                for data in [from_bytes(storage[offset:offset+group_bytes], endian) for offset in range(first, group_end, bitwidth)]
+                for shift in shifts])
+    if remainder:
+        end = (bits + count * bitwidth + 7) >> 3
+        data = from_bytes(storage[group_end:end], endian)
+        if endian == 'little':
+            shifts = range(bitshift, bitshift + remainder * bitwidth, bitwidth)
+        else:
+            top = (end - group_end) * 8 - bitshift
+            shifts = range(top - bitwidth, top - (remainder + 1) * bitwidth, -bitwidth)
+        out.extend([(data >> shift) & value_mask for shift in shifts])
+
+def _encode_range(storage, bitwidth, bitoffset, endian, start_idx, count, values):
+    '''Encode count values into packed storage from index start_idx, one read-modify-write per block.'''
+    value_mask = (1 << bitwidth) - 1
+    block_size = max(1, _BLOCK_BITS // bitwidth)
+    for offset in range(0, count, block_size):
+        block_values = values[offset : min(offset + block_size, count)]
+        block_bits = len(block_values) * bitwidth
+        bits = (start_idx + offset) * bitwidth + bitoffset
+        first = bits >> 3
+        end = (bits + block_bits + 7) >> 3
+        if endian == 'little':
+            shift = bits & 7
+            shifts = range(0, block_bits, bitwidth)
+        else:
+            shift = end * 8 - bits - block_bits
+            shifts = range(block_bits - bitwidth, -1, -bitwidth)
+        data = 0
+        for value_shift, value in zip(shifts, block_values):
+            data |= (value & value_mask) << value_shift
+        data_mask = ((1 << block_bits) - 1) << shift
+        data = (int.from_bytes(storage[first:end], endian) & ~data_mask) | (data << shift)
+        storage[first:end] = data.to_bytes(end - first, endian)
+
+_BOUND_ATTRIBUTES = frozenset(['bitwidth', 'storage', 'length', 'bitoffset', 'endian', 'layout', 'cumulative']) # captured by PackedIntArray._bind
+
 class PackedIntArray:
     '''
     A simple packed integer array.
@@ -7,74 +107,496 @@ class PackedIntArray:
     Usage: PackedIntArray(bitwidth, storage, endian='little')[idx]
 
     If an integer is passed rather than a storage object, a new bytearray is allocated of sufficient size to hold that many bitwidths.
+
+    Slicing returns a new PackedIntArray over a memoryview of the same storage, without copying.
+    Like a NumPy view, writes through the slice change the parent array. While a slice, or an array of native 8, 16, 32
+    or 64-bit values, exists over a bytearray, the bytearray cannot be resized.
+
+    With layout='interleaved', values are stored in blocks of 128 dealt round-robin across four 32-bit lanes,
+    each lane packing its 32 values consecutively into bitwidth words (the vertical layout of SIMD-BP128 and FastLanes).
+    A whole block can then be unpacked with the same shifts in every lane. This needs bitwidth <= 32, bitoffset 0,
+    and a length that is a multiple of 128.
+
+    With cumulative=True, the storage holds XOR deltas and each element reads as the XOR of every stored value up to
+    and including it, so sequences of similar values pack into small bitwidths. Bulk reads fuse the unpack with a running
+    XOR; a scalar access costs time proportional to its index.
+
+    With mutable=False, or after freeze(), the storage is copied into bytes: reads are faster than from a bytearray on
+    CPython, writes raise TypeError, and slices are copied into bytes of their own, which is safe as neither can change.
     '''
-    def __init__(self, bitwidth, storage = None, length = None, bitoffset = 0, endian = 'little'):
+    __slots__ = ('bitwidth', 'storage', 'length', 'bitoffset', 'endian', 'layout', 'value_mask', 'cumulative', '_block_struct', '_fast_view', '_decode', '_encode', '_encode_stored', '__weakref__')
+    def __init__(self, bitwidth, storage = None, length = None, bitoffset = 0, endian = 'little', layout = 'packed', cumulative = False, mutable = True):
         assert endian in ['little', 'big']
+        assert layout in ['packed', 'interleaved']
         assert storage is not None or length is not None
         if type(storage) is int:
             length = storage
             storage = None
         if storage is None:
-            storage = bytearray((length * bitwidth - 1) // 8 + 1) # ceil(x / y) == (x - 1) // y + 1
-        if length is None:
+            # ceil(x / y) == (x - 1) // y + 1
+            storage = bytearray((length * bitwidth - 1) // 8 + 1)
+        if layout == 'interleaved':
+            assert bitwidth <= 32 and bitoffset == 0
+            if length is None:
+                length = len(storage) // (16 * bitwidth) * 128
+            assert length % 128 == 0
+        elif length is None:
             length = (len(storage) * 8 - bitoffset) // bitwidth
         self.bitwidth = bitwidth
+        if not mutable:
+            storage = bytes(storage)
         self.storage = storage
         self.length = length
         self.bitoffset = bitoffset
         self.endian = endian
-        self.get_shift = getattr(self, '_get_shift_' + endian)
-        self.value_mask = (1 << bitwidth) - 1
+        self.layout = layout
+        self.cumulative = cumulative
+        self._bind()
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        # the accessors capture the configuration, so changing it after construction rebinds them
+        if name in _BOUND_ATTRIBUTES and hasattr(self, '_decode'):
+            self._bind()
+    def freeze(self):
+        '''Copy the storage into an immutable bytes object, which reads take faster paths on, and rebind the accessors to it.'''
+        self.storage = bytes(self.storage)
     def __len__(self):
         return self.length
-    def _get_shift_big(self, bitoffset_left, bitoffset_right):
-        return 8 - bitoffset_right
-    def _get_shift_little(self, bitoffset_left, bitoffset_right):
-        return bitoffset_left
+    def __reduce__(self):
+        # the accessors and views are rebuilt by __init__; a memoryview cannot be pickled, so its bytes are copied
+        storage = self.storage
+        if type(storage) is memoryview:
+            storage = bytes(storage) if storage.readonly else bytearray(storage)
+        return (type(self), (self.bitwidth, storage, self.length, self.bitoffset, self.endian, self.layout, self.cumulative))
+    def _bind(self):
+        '''
+        Build the scalar _decode(index) and _encode(index, value) closures for the storage and layout.
+
+        Everything they need is captured as closure variables, so an access does no attribute lookups or method dispatch.
+        Assigning any of bitwidth, storage, length, bitoffset, endian, layout or cumulative calls this again.
+        '''
+        storage = self.storage
+        bitwidth = self.bitwidth
+        bitoffset = self.bitoffset
+        endian = self.endian
+        self.value_mask = value_mask = (1 << bitwidth) - 1
+        fast_format = {8: 'B', 16: 'H', 32: 'I', 64: 'Q'}.get(bitwidth)
+        self._fast_view = None
+        if (self.layout == 'packed' and bitoffset == 0 and fast_format is not None
+                and struct.calcsize(fast_format) * 8 == bitwidth and (bitwidth == 8 or endian == sys.byteorder)):
+            # every value is a whole native integer, so a cast memoryview indexes it with no shifts or masks
+            fast_view = self._fast_view = memoryview(storage).cast('B')[:self.length * (bitwidth // 8)].cast(fast_format)
+            decode = fast_view.__getitem__
+            def encode(index, value):
+                fast_view[index] = value & value_mask
+        elif self.layout == 'interleaved':
+            # every block has the same shape, so the byte offset and shift of each of its 128 positions is tabulated once
+            self._block_struct = struct.Struct(('<' if endian == 'little' else '>') + str(4 * bitwidth) + 'I')
+            block_bytes = 16 * bitwidth
+            positions = []
+            for lane_index in range(128):
+                word, shift = self.get_word_shift(lane_index)
+                positions.append((word * 4, shift, shift + bitwidth > 32))
+            byteorder = '<' if endian == 'little' else '>'
+            word_struct = struct.Struct(byteorder + 'I')
+            unpack_word = word_struct.unpack_from
+            pack_word = word_struct.pack_into
+            # a value that straddles two words of its lane is read as one 64-bit window: the word and the lane's next word 16 bytes on
+            unpack_pair = struct.Struct(byteorder + 'I12xI').unpack_from
+            def decode(index):
+                block, lane_index = divmod(index, 128)
+                start, shift, straddles = positions[lane_index]
+                start += block * block_bytes
+                if straddles:
+                    low, high = unpack_pair(storage, start)
+                    return (((high << 32) | low) >> shift) & value_mask
+                return (unpack_word(storage, start)[0] >> shift) & value_mask
+            def encode(index, value):
+                block, lane_index = divmod(index, 128)
+                start, shift, straddles = positions[lane_index]
+                start += block * block_bytes
+                if straddles:
+                    low, high = unpack_pair(storage, start)
+                    window = ((high << 32) | low) & ~(value_mask << shift) | ((value & value_mask) << shift)
+                    pack_word(storage, start, window & 0xffffffff)
+                    pack_word(storage, start + 16, window >> 32)
+                else:
+                    low, = unpack_word(storage, start)
+                    pack_word(storage, start, low & ~(value_mask << shift) | ((value & value_mask) << shift))
+        elif bitwidth <= 57:
+            # any value fits in the 8 bytes starting at its first byte
+            word_struct = struct.Struct('<Q' if endian == 'little' else '>Q')
+            unpack_word = word_struct.unpack_from
+            pack_word = word_struct.pack_into
+            # shift of a value within its word is ((bits ^ bit_flip) & 7) + shift_base, without branching on endian:
+            # little endian counts up from the low bit, big endian counts down from the high bit (64 - bitwidth - (bits & 7))
+            bit_flip = 0 if endian == 'little' else 7
+            shift_base = 0 if endian == 'little' else 57 - bitwidth
+            def read_partial_word(byte):
+                # a word running past the end of the storage, as if the storage were padded with zeros
+                return int.from_bytes(bytes(storage[byte:byte+8]).ljust(8, b'\0'), endian)
+            def decode(index):
+                bits = index * bitwidth + bitoffset
+                try:
+                    word, = unpack_word(storage, bits >> 3)
+                except struct.error:
+                    word = read_partial_word(bits >> 3)
+                return (word >> (((bits ^ bit_flip) & 7) + shift_base)) & value_mask
+            def encode(index, value):
+                bits = index * bitwidth + bitoffset
+                shift = ((bits ^ bit_flip) & 7) + shift_base
+                byte = bits >> 3
+                try:
+                    word, = unpack_word(storage, byte)
+                except struct.error:
+                    word = read_partial_word(byte)
+                    word = word & ~(value_mask << shift) | ((value & value_mask) << shift)
+                    storage[byte:len(storage)] = word.to_bytes(8, endian)[:len(storage) - byte]
+                    return
+                pack_word(storage, byte, word & ~(value_mask << shift) | ((value & value_mask) << shift))
+        else:
+            # a value lies within window_bytes bytes of its first byte, so a fixed-size window is read without computing
+            # where the value ends; only at the end of unpadded storage is the window shorter
+            window_bytes = (bitwidth + 14) >> 3
+            if endian == 'little':
+                def decode(index):
+                    bits = index * bitwidth + bitoffset
+                    byte = bits >> 3
+                    return (int.from_bytes(storage[byte:byte+window_bytes], 'little') >> (bits & 7)) & value_mask
+                def encode(index, value):
+                    bits = index * bitwidth + bitoffset
+                    byte = bits >> 3
+                    shift = bits & 7
+                    window = storage[byte:byte+window_bytes]
+                    size = len(window)
+                    data = int.from_bytes(window, 'little') & ~(value_mask << shift) | ((value & value_mask) << shift)
+                    storage[byte:byte+size] = data.to_bytes(size, 'little')
+            else:
+                def decode(index):
+                    bits = index * bitwidth + bitoffset
+                    byte = bits >> 3
+                    window = storage[byte:byte+window_bytes]
+                    return (int.from_bytes(window, 'big') >> (len(window) * 8 - bitwidth - (bits & 7))) & value_mask
+                def encode(index, value):
+                    bits = index * bitwidth + bitoffset
+                    byte = bits >> 3
+                    window = storage[byte:byte+window_bytes]
+                    size = len(window)
+                    shift = size * 8 - bitwidth - (bits & 7)
+                    data = int.from_bytes(window, 'big') & ~(value_mask << shift) | ((value & value_mask) << shift)
+                    storage[byte:byte+size] = data.to_bytes(size, 'big')
+        self._encode_stored = encode
+        if self.cumulative:
+            # the stored values are deltas, and an element is the XOR of every delta up to and including it
+            length = self.length
+            decode_delta = decode
+            encode_delta = encode
+            def decode(index):
+                return functools.reduce(operator.xor, map(decode_delta, range(index + 1)), 0)
+            def encode(index, value):
+                previous = decode(index - 1) if index else 0
+                old_value = previous ^ decode_delta(index)
+                encode_delta(index, value ^ previous)
+                if index + 1 < length:
+                    # keep the following elements unchanged
+                    encode_delta(index + 1, decode_delta(index + 1) ^ old_value ^ value)
+        self._decode = decode
+        self._encode = encode
     def get_range_bitoffsets(self, index, count=1):
         bitwidth = self.bitwidth
         bits = index * bitwidth + self.bitoffset
         start, bitoffset_left = divmod(bits, 8)
-        end, bitoffset_right = divmod(bits + bitwidth * count + 8, 8)
+        end_bits = bits + bitwidth * count
+        end = (end_bits + 7) // 8
+        bitoffset_right = end_bits % 8
         return [start, end, bitoffset_left, bitoffset_right]
+    def get_word_shift(self, index):
+        '''For the interleaved layout, return the index of the 32-bit word holding the low bits of a value, and its shift in that word.'''
+        block, lane_index = divmod(index, 128)
+        slot, lane = divmod(lane_index, 4)
+        word, lane_shift = divmod(slot * self.bitwidth, 32)
+        return [(block * self.bitwidth + word) * 4 + lane, lane_shift]
+    def _check_index(self, index):
+        # negative indices count back from the end as for a list, so every layout and bitwidth agrees on them
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('PackedIntArray index out of range')
+        return index
     def __getitem__(self, index):
-        if type(index) is slice:
-            slice_start, slice_stop, slice_stride = index.indices(len(self))
-            assert slice_stride in [None,1] # todo if desired
-            count = slice_stop - slice_start
-            start, end, *bitoffsets = self.get_range_bitoffsets(slice_start, count)
-            shift = self.get_shift(*bitoffsets)
-            return type(self)(self.bitwidth, self.storage[start:end], count, shift, self.endian)
-        else:
-            start, end, *bitoffsets = self.get_range_bitoffsets(index)
-            shift = self.get_shift(*bitoffsets)
-            return (int.from_bytes(self.storage[start:end], self.endian) >> shift) & self.value_mask
+        if type(index) is not slice:
+            if not 0 <= index < self.length:
+                index = self._check_index(index)
+            return self._decode(index)
+        slice_start, slice_stop, slice_stride = index.indices(len(self))
+        assert slice_stride in [None,1] # todo if desired
+        return self.get_slice(slice_start, slice_stop)
+    def get_slice(self, start, stop):
+        '''Return a PackedIntArray viewing the elements from index start up to stop, sharing this array's storage.'''
+        assert not self.cumulative # todo if desired
+        count = stop - start
+        # frozen storage keeps the faster reads of bytes, rather than sharing through a memoryview
+        storage = self.storage if type(self.storage) is bytes else memoryview(self.storage)
+        if self.layout == 'interleaved':
+            assert start % 128 == 0 and count % 128 == 0 # todo if desired
+            block_bytes = 16 * self.bitwidth
+            first = start // 128 * block_bytes
+            return type(self)(self.bitwidth, storage[first:first + count // 128 * block_bytes], count, 0, self.endian, self.layout)
+        first, end, bitoffset_left, bitoffset_right = self.get_range_bitoffsets(start, count)
+        return type(self)(self.bitwidth, storage[first:end], count, bitoffset_left, self.endian)
     def __setitem__(self, index, value):
-        start, end, *bitoffsets = self.get_range_bitoffsets(index)
-        shift = self.get_shift(*bitoffsets)
-        data = (int.from_bytes(self.storage[start:end], self.endian) & ~(self.value_mask << shift)) | (value << shift)
-        self.storage[start:end] = data.to_bytes(end - start, self.endian)
+        if not 0 <= index < self.length:
+            index = self._check_index(index)
+        self._encode(index, value)
+    def get_block(self, block_idx):
+        '''For the interleaved layout, decode the 128 values of one block into a list.'''
+        bitwidth = self.bitwidth
+        value_mask = self.value_mask
+        words = self._block_struct.unpack_from(self.storage, block_idx * 16 * bitwidth)
+        shifts = range(0, 32 * bitwidth, bitwidth)
+        values = [0] * 128
+        for lane in range(4):
+            data = 0
+            for word in reversed(words[lane::4]):
+                data = (data << 32) | word
+            values[lane::4] = [(data >> shift) & value_mask for shift in shifts]
+        return values
+    def get_many(self, start, count):
+        '''Decode count consecutive values starting at index start into a list.'''
+        if self.cumulative:
+            previous = functools.reduce(operator.xor, self._get_stored(0, start), 0)
+            return list(itertools.accumulate(self._get_stored(start, count), operator.xor, initial=previous))[1:]
+        return self._get_stored(start, count)
+    def _get_stored(self, start, count):
+        if self._fast_view is not None:
+            return self._fast_view[start:start + count].tolist()
+        if self.layout == 'interleaved':
+            values = []
+            for block_idx in range(start // 128, (start + count + 127) // 128):
+                values.extend(self.get_block(block_idx))
+            return values[start % 128 : start % 128 + count]
+        values = []
+        _decode_range(self.storage, self.bitwidth, self.bitoffset, self.endian, start, count, values)
+        return values
+    def set_many(self, start, count, values):
+        '''Encode up to count consecutive values, taken from any iterable, starting at index start.'''
+        values = list(itertools.islice(values, count))
+        if self.cumulative:
+            if not values:
+                return
+            end = start + len(values)
+            previous = self.get_many(start - 1, 1)[0] if start else 0
+            if end < self.length:
+                following = self.get_many(end, 1)[0]
+            self._set_stored(start, len(values), list(map(operator.xor, values, [previous] + values[:-1])))
+            if end < self.length:
+                # keep the following elements unchanged
+                self._set_stored(end, 1, [following ^ values[-1]])
+            return
+        self._set_stored(start, len(values), values)
+    def fill_from(self, values):
+        '''
+        Encode the values of an iterable into the array from index 0, for fast bulk construction.
+
+        Values are consumed in blocks of 4096 and each packed block is written with one sequential store,
+        rather than a read-modify-write per value; the interleaved layout still writes each value on its own.
+        Elements past the end of values are left unchanged.
+        '''
+        if self.cumulative:
+            # set_many stores the deltas and corrects the one after the last value
+            self.set_many(0, len(self), values)
+            return
+        values = iter(values)
+        for start in range(0, len(self), 4096):
+            block = list(itertools.islice(values, min(4096, len(self) - start)))
+            self._set_stored(start, len(block), block)
+            if len(block) < 4096:
+                break
+    def _set_stored(self, start, count, values):
+        if self._fast_view is not None:
+            values = array.array(self._fast_view.format, map(self.value_mask.__and__, values[:count]))
+            self._fast_view[start:start + len(values)] = values
+            return
+        if self.layout == 'interleaved':
+            for index, value in zip(range(start, start + count), values):
+                self._encode_stored(index, value)
+            return
+        _encode_range(self.storage, self.bitwidth, self.bitoffset, self.endian, start, count, values)
     def __iter__(self):
-        for idx in range(len(self)):
-            yield self[idx]
+        # values are decoded 4096 at a time, and chaining the decoded lists keeps the per-value iteration in C
+        length = len(self)
+        values = itertools.chain.from_iterable(self._get_stored(start, min(4096, length - start)) for start in range(0, length, 4096))
+        if self.cumulative:
+            values = itertools.accumulate(values, operator.xor)
+        return values
+    def _read_bits(self, start, count):
+        # the packed bits of elements start up to start + count as one integer, ordered as in the storage
+        bits = start * self.bitwidth + self.bitoffset
+        nbits = count * self.bitwidth
+        first = bits >> 3
+        end = (bits + nbits + 7) >> 3
+        with memoryview(self.storage) as view:
+            data = int.from_bytes(view[first:end], self.endian)
+        shift = bits & 7 if self.endian == 'little' else end * 8 - bits - nbits
+        return (data >> shift) & ((1 << nbits) - 1)
+    def popcount(self):
+        '''Return the number of set bits across all values, e.g. the number of ones in a bitwidth 1 bitmap.'''
+        return self.rank(len(self))
+    def rank(self, index):
+        '''Return the number of set bits in the values before index.'''
+        if self.layout == 'packed' and not self.cumulative:
+            # one int.from_bytes and one C-level bit count over the whole range
+            return self._read_bits(0, index).bit_count()
+        return sum(map(int.bit_count, self.get_many(0, index)))
+    def select(self, k):
+        '''For bitwidth 1, return the index of the value holding the k-th set bit, counting from 0.'''
+        assert self.bitwidth == 1
+        if k < 0:
+            raise IndexError('select index out of range')
+        if self.layout != 'packed' or self.cumulative:
+            for index in itertools.islice(itertools.compress(itertools.count(), self), k, None):
+                return index
+            raise IndexError('select index out of range')
+        nbits = len(self)
+        data = self._read_bits(0, nbits)
+        if k >= data.bit_count():
+            raise IndexError('select index out of range')
+        # halve the range, keeping the half that holds the k-th set bit; element 0 is the low bit when little endian
+        # and the high bit when big endian
+        index = 0
+        while nbits > 1:
+            half = nbits >> 1
+            if self.endian == 'little':
+                head, tail = data & ((1 << half) - 1), data >> half
+            else:
+                head, tail = data >> (nbits - half), data & ((1 << (nbits - half)) - 1)
+            head_count = head.bit_count()
+            if k < head_count:
+                data, nbits = head, half
+            else:
+                k -= head_count
+                data, nbits = tail, nbits - half
+                index += half
+        return index
 
 def _test():
-    import tqdm
-    for bitwidth in [3, 9]:
+    import copy, pickle, random, weakref
+    rng = random.Random(0)
+    for bitwidth in [1, 2, 3, 4, 8, 9, 16, 32, 60, 64]:
         for endian in ['little', 'big']:
-            ints = list(range(1<<bitwidth))
-            testarray = PackedIntArray(bitwidth, storage=len(ints), endian='little')
+            # every value of narrow bitwidths, and random ones of wide bitwidths
+            ints = list(range(min(512, 1 << bitwidth)))
+            ints += [rng.getrandbits(bitwidth) for _ in range(512 - len(ints))]
+            testarray = PackedIntArray(bitwidth, storage=len(ints), endian=endian)
             assert len(testarray) == len(ints)
+            assert len(testarray.storage) == (len(ints) * bitwidth + 7) // 8
             for idx in range(len(ints)):
                 testarray[idx] = ints[idx]
             for idx in range(len(ints)):
                 assert testarray[idx] == ints[idx]
-            for start in tqdm.tqdm([None] + list(range(len(ints))), desc=f'all {bitwidth}bit {endian} slices'):
-                for stop in [None] + list(range(start or 0, len(ints))):
-                    subarray = testarray[start:stop]
-                    subints = ints[start:stop]
-                    for idx in range(len(subints)):
-                        assert subarray[idx] == subints[idx]
+            assert list(testarray) == ints
+            filled = PackedIntArray(bitwidth, storage=len(ints), endian=endian)
+            filled.fill_from(iter(ints))
+            assert filled.storage == testarray.storage
+            filled.freeze()
+            assert list(filled) == ints and list(filled[1:-1]) == ints[1:-1]
+            assert type(filled[1:-1].storage) is bytes
+            for idx in range(len(ints)):
+                assert filled[idx] == ints[idx]
+            readonly = PackedIntArray(bitwidth, testarray.storage, len(ints), endian=endian, mutable=False)
+            assert type(readonly.storage) is bytes and list(readonly) == ints
+            for frozen in [filled, readonly]:
+                try:
+                    frozen[0] = 1
+                except TypeError:
+                    pass
+                else:
+                    assert False, 'frozen array was written'
+            assert testarray.get_many(0, len(ints)) == ints
+            assert testarray[-1] == ints[-1] and testarray[-len(ints)] == ints[0]
+            for index in [len(ints), -len(ints) - 1]:
+                try:
+                    testarray[index]
+                except IndexError:
+                    pass
+                else:
+                    assert False, 'index out of range did not raise'
+            # a bitoffset of 4 leaves values of bitwidth 1, 2 and 4 before and after the whole bytes decoded by table
+            shifted = PackedIntArray(bitwidth, bytearray(len(testarray.storage) + 1), len(ints), bitoffset=4, endian=endian)
+            shifted.fill_from(ints)
+            assert list(shifted) == ints and shifted.get_many(3, 101) == ints[3:104]
+            assert list(testarray[3:104]) == ints[3:104]
+            # storage supplied by the caller has no bytes past the last value, so the last reads and writes are short
+            unpadded = PackedIntArray(bitwidth, bytearray(testarray.storage), endian=endian)
+            assert len(unpadded) == len(ints) and unpadded[len(ints) - 1] == ints[-1]
+            unpadded[len(ints) - 1] = ints[-2]
+            assert unpadded.get_many(len(ints) - 2, 2) == [ints[-2], ints[-2]]
+            partial = PackedIntArray(bitwidth, storage=len(ints), endian=endian)
+            partial[0] = -1
+            partial[1] = 1 << bitwidth
+            assert partial.get_many(0, 2) == [(1 << bitwidth) - 1, 0]
+            partial.set_many(0, 4, iter([-1, 1 << bitwidth]))
+            assert partial.get_many(0, 3) == [(1 << bitwidth) - 1, 0, 0]
+            assert list(pickle.loads(pickle.dumps(testarray))) == ints
+            assert weakref.ref(testarray)() is testarray
+            replaced = PackedIntArray(bitwidth, storage=len(ints), endian=endian)
+            replaced[0] = 1
+            replaced.storage = bytearray(len(replaced.storage))
+            assert replaced[0] == 0 and replaced.get_many(0, 1) == [0]
+            if bitwidth not in (8, 16, 32, 64):
+                resizable = bytearray(testarray.storage)
+                PackedIntArray(bitwidth, resizable, endian=endian).popcount()
+                resizable.append(0) # no memoryview of it outlives the array's reads
+            assert type(pickle.loads(pickle.dumps(filled)).storage) is bytes
+            copied = copy.deepcopy(testarray[1:-1])
+            copied[0] = 0
+            assert list(copied) == [0] + ints[2:-1] and testarray[1] == ints[1]
+            if bitwidth <= 32:
+                interleaved_ints = [idx % (1 << bitwidth) for idx in range(512)]
+                interleaved = PackedIntArray(bitwidth, storage=len(interleaved_ints), endian=endian, layout='interleaved')
+                for idx in range(len(interleaved_ints)):
+                    interleaved[idx] = interleaved_ints[idx]
+                assert list(interleaved) == interleaved_ints
+                assert list(interleaved[128:384]) == interleaved_ints[128:384]
+            assert testarray.popcount() == sum(bin(value).count('1') for value in ints)
+            for index in [0, 1, 7, 100, len(ints)]:
+                assert testarray.rank(index) == sum(bin(value).count('1') for value in ints[:index])
+            if bitwidth == 1:
+                ones = [idx for idx, value in enumerate(ints) if value]
+                for k in range(len(ones)):
+                    assert testarray.select(k) == ones[k]
+                for k in [-1, len(ones)]:
+                    try:
+                        testarray.select(k)
+                    except IndexError:
+                        pass
+                    else:
+                        assert False, 'select out of range did not raise'
+            cumulative = PackedIntArray(bitwidth, storage=len(ints), endian=endian, cumulative=True)
+            cumulative.fill_from(ints)
+            assert list(cumulative) == ints
+            assert cumulative[-1] == ints[-1]
+            cumulative[-1] = ints[-2]
+            assert cumulative.get_many(len(ints) - 2, 2) == [ints[-2], ints[-2]]
+            cumulative[-1] = ints[-1]
+            cumulative[5] = 0
+            assert cumulative.get_many(4, 3) == [ints[4], 0, ints[6]]
+            cumulative.fill_from(ints[:3])
+            assert list(cumulative) == ints[:5] + [0] + ints[6:]
+            # decoding depends only on the slice endpoints, so sampling them covers what checking every slice did
+            slices = [(None, None), (0, 0), (0, len(ints)), (len(ints), len(ints))]
+            slices += [sorted([rng.randint(0, len(ints)), rng.randint(0, len(ints))]) for _ in range(512)]
+            for start, stop in slices:
+                subarray = testarray[start:stop]
+                subints = ints[start:stop]
+                assert len(subarray) == len(subints)
+                assert list(subarray) == subints
+                for idx in range(len(subints)):
+                    assert subarray[idx] == subints[idx]
+            subarray = testarray[1:]
+            subarray[0] = 0
+            assert testarray[1] == 0 # slices are views
+            testarray[1] = ints[1]
 
 if __name__ == '__main__':
     _test()